@@ -32,6 +32,7 @@ class Bot(Client):
             api_hash=Config.API_HASH,
             bot_token=Config.BOT_TOKEN,
             workers=200,
+            max_concurrent_transmissions=Config.MAX_CONCURRENT_TRANSMISSIONS,
             plugins={"root": "plugins"},
             sleep_threshold=15,
         )
@@ -8,6 +8,9 @@ class Config(object):
     API_ID    = os.environ.get("API_ID", "22451708")
     API_HASH  = os.environ.get("API_HASH", "288f749fcef814c1ec90b66936158c68")
     BOT_TOKEN = os.environ.get("BOT_TOKEN", "7012541014:AAFI2an6FRSqyZSYrXqyHuxYxSYeNNgNBiU") 
+    MAX_CONCURRENT_TRANSMISSIONS = int(os.environ.get("MAX_CONCURRENT_TRANSMISSIONS", "8"))
+    DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "4"))
+    FFMPEG_PARALLELISM = int(os.environ.get("FFMPEG_PARALLELISM", "2"))
 
     # database config
     DB_NAME = os.environ.get("DB_NAME","rename")     
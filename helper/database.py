@@ -1,6 +1,7 @@
 import motor.motor_asyncio, datetime, pytz
 from config import Config
 import logging  # Added for logging errors and important information
+from cachetools import TTLCache
 from .utils import send_log
 
 
@@ -15,6 +16,19 @@ class Database:
             raise e  # Re-raise the exception after logging it
         self.codeflixbots = self._client[database_name]
         self.col = self.codeflixbots.user
+        # Recently read user documents, dropped whenever the user is written to
+        self._user_cache = TTLCache(maxsize=10000, ttl=300)
+
+    async def _get_user(self, id):
+        id = int(id)
+        if id in self._user_cache:
+            return self._user_cache[id]
+        user = await self.col.find_one({"_id": id})
+        self._user_cache[id] = user
+        return user
+
+    def _invalidate(self, id):
+        self._user_cache.pop(int(id), None)
 
     def new_user(self, id):
         return dict(
@@ -39,19 +53,28 @@ class Database:
             )
         )
 
+    async def ensure_user(self, id):
+        """Create the user's document if missing in one upsert, returning True if it was created"""
+        defaults = self.new_user(id)
+        del defaults["_id"]
+        result = await self.col.update_one(
+            {"_id": int(id)}, {"$setOnInsert": defaults}, upsert=True
+        )
+        self._invalidate(id)
+        return result.upserted_id is not None
+
     async def add_user(self, b, m):
         u = m.from_user
         if not await self.is_user_exist(u.id):
-            user = self.new_user(u.id)
             try:
-                await self.col.insert_one(user)
-                await send_log(b, u)
+                if await self.ensure_user(u.id):
+                    await send_log(b, u)
             except Exception as e:
                 logging.error(f"Error adding user {u.id}: {e}")
 
     async def is_user_exist(self, id):
         try:
-            user = await self.col.find_one({"_id": int(id)})
+            user = await self._get_user(id)
             return bool(user)
         except Exception as e:
             logging.error(f"Error checking if user {id} exists: {e}")
@@ -76,18 +99,20 @@ class Database:
     async def delete_user(self, user_id):
         try:
             await self.col.delete_many({"_id": int(user_id)})
+            self._invalidate(user_id)
         except Exception as e:
             logging.error(f"Error deleting user {user_id}: {e}")
 
     async def set_thumbnail(self, id, file_id):
         try:
             await self.col.update_one({"_id": int(id)}, {"$set": {"file_id": file_id}})
+            self._invalidate(id)
         except Exception as e:
             logging.error(f"Error setting thumbnail for user {id}: {e}")
 
     async def get_thumbnail(self, id):
         try:
-            user = await self.col.find_one({"_id": int(id)})
+            user = await self._get_user(id)
             return user.get("file_id", None) if user else None
         except Exception as e:
             logging.error(f"Error getting thumbnail for user {id}: {e}")
@@ -96,12 +121,13 @@ class Database:
     async def set_caption(self, id, caption):
         try:
             await self.col.update_one({"_id": int(id)}, {"$set": {"caption": caption}})
+            self._invalidate(id)
         except Exception as e:
             logging.error(f"Error setting caption for user {id}: {e}")
 
     async def get_caption(self, id):
         try:
-            user = await self.col.find_one({"_id": int(id)})
+            user = await self._get_user(id)
             return user.get("caption", None) if user else None
         except Exception as e:
             logging.error(f"Error getting caption for user {id}: {e}")
@@ -112,12 +138,13 @@ class Database:
             await self.col.update_one(
                 {"_id": int(id)}, {"$set": {"format_template": format_template}}
             )
+            self._invalidate(id)
         except Exception as e:
             logging.error(f"Error setting format template for user {id}: {e}")
 
     async def get_format_template(self, id):
         try:
-            user = await self.col.find_one({"_id": int(id)})
+            user = await self._get_user(id)
             return user.get("format_template", None) if user else None
         except Exception as e:
             logging.error(f"Error getting format template for user {id}: {e}")
@@ -128,71 +155,106 @@ class Database:
             await self.col.update_one(
                 {"_id": int(id)}, {"$set": {"media_type": media_type}}
             )
+            self._invalidate(id)
         except Exception as e:
             logging.error(f"Error setting media preference for user {id}: {e}")
 
     async def get_media_preference(self, id):
         try:
-            user = await self.col.find_one({"_id": int(id)})
+            user = await self._get_user(id)
             return user.get("media_type", None) if user else None
         except Exception as e:
             logging.error(f"Error getting media preference for user {id}: {e}")
             return None
 
     async def get_metadata(self, user_id):
-        user = await self.col.find_one({'_id': int(user_id)})
+        user = await self._get_user(user_id)
         return user.get('metadata', "Off")
 
     async def set_metadata(self, user_id, metadata):
         await self.col.update_one({'_id': int(user_id)}, {'$set': {'metadata': metadata}})
+        self._invalidate(user_id)
 
     async def get_title(self, user_id):
-        user = await self.col.find_one({'_id': int(user_id)})
+        user = await self._get_user(user_id)
         return user.get('title', 'Encoded by @Anime_Mortals')
 
     async def set_title(self, user_id, title):
         await self.col.update_one({'_id': int(user_id)}, {'$set': {'title': title}})
+        self._invalidate(user_id)
 
     async def get_author(self, user_id):
-        user = await self.col.find_one({'_id': int(user_id)})
+        user = await self._get_user(user_id)
         return user.get('author', '@Anime_Mortals')
 
     async def set_author(self, user_id, author):
         await self.col.update_one({'_id': int(user_id)}, {'$set': {'author': author}})
+        self._invalidate(user_id)
 
     async def get_artist(self, user_id):
-        user = await self.col.find_one({'_id': int(user_id)})
+        user = await self._get_user(user_id)
         return user.get('artist', '@Anime_Mortals')
 
     async def set_artist(self, user_id, artist):
         await self.col.update_one({'_id': int(user_id)}, {'$set': {'artist': artist}})
+        self._invalidate(user_id)
 
     async def get_audio(self, user_id):
-        user = await self.col.find_one({'_id': int(user_id)})
+        user = await self._get_user(user_id)
         return user.get('audio', 'By @Anime_Mortals')
 
     async def set_audio(self, user_id, audio):
         await self.col.update_one({'_id': int(user_id)}, {'$set': {'audio': audio}})
+        self._invalidate(user_id)
 
     async def get_subtitle(self, user_id):
-        user = await self.col.find_one({'_id': int(user_id)})
+        user = await self._get_user(user_id)
         return user.get('subtitle', "By @Anime_Mortals")
 
     async def set_subtitle(self, user_id, subtitle):
         await self.col.update_one({'_id': int(user_id)}, {'$set': {'subtitle': subtitle}})
+        self._invalidate(user_id)
 
     async def get_video(self, user_id):
-        user = await self.col.find_one({'_id': int(user_id)})
+        user = await self._get_user(user_id)
         return user.get('video', 'Encoded By @Anime_Mortals')
 
     async def set_video(self, user_id, video):
         await self.col.update_one({'_id': int(user_id)}, {'$set': {'video': video}})
+        self._invalidate(user_id)
+
+    async def get_metadata_bundle(self, user_id):
+        """Return the metadata toggle and all tag fields from a single user read"""
+        user = await self._get_user(user_id) or {}
+        return {
+            'metadata': user.get('metadata', "Off"),
+            'title': user.get('title', 'Encoded by @Anime_Mortals'),
+            'artist': user.get('artist', '@Anime_Mortals'),
+            'author': user.get('author', '@Anime_Mortals'),
+            'video': user.get('video', 'Encoded By @Anime_Mortals'),
+            'audio': user.get('audio', 'By @Anime_Mortals'),
+            'subtitle': user.get('subtitle', "By @Anime_Mortals")
+        }
+
+    async def get_upload_settings(self, id):
+        """Return caption, thumbnail, media preference and metadata toggle from a single user read"""
+        try:
+            user = await self._get_user(id) or {}
+        except Exception as e:
+            logging.error(f"Error getting upload settings for user {id}: {e}")
+            user = {}
+        return {
+            'caption': user.get("caption"),
+            'thumbnail': user.get("file_id"),
+            'media_type': user.get("media_type"),
+            'metadata': user.get('metadata', "Off")
+        }
 
     # Premium User Methods
     async def is_premium_user(self, id):
         """Check if a user is premium and their subscription hasn't expired"""
         try:
-            user = await self.col.find_one({"_id": int(id)})
+            user = await self._get_user(id)
             if not user or "premium" not in user:
                 return False
                 
@@ -214,6 +276,7 @@ class Database:
                     {"_id": int(id)},
                     {"$set": {"premium.is_premium": False}}
                 )
+                self._invalidate(id)
                 return False
                 
             return True
@@ -256,6 +319,7 @@ class Database:
                 }},
                 upsert=True
             )
+            self._invalidate(id)
             return True, expiry_date.isoformat()
         except Exception as e:
             logging.error(f"Error adding premium user {id}: {e}")
@@ -264,7 +328,7 @@ class Database:
     async def get_premium_details(self, id):
         """Get premium details for a user"""
         try:
-            user = await self.col.find_one({"_id": int(id)})
+            user = await self._get_user(id)
             if not user or "premium" not in user:
                 return None
             
@@ -280,6 +344,7 @@ class Database:
                 {"_id": int(id)},
                 {"$set": {"premium.is_premium": False}}
             )
+            self._invalidate(id)
             return True
         except Exception as e:
             logging.error(f"Error removing premium from user {id}: {e}")
@@ -7,36 +7,54 @@ import re
 
 
 async def progress_for_pyrogram(current, total, ud_type, message, start):
-    now = time.time()
+    now = time.monotonic()
     diff = now - start
     if round(diff % 5.00) == 0 or current == total:        
-        percentage = current * 100 / total
-        speed = current / diff
-        elapsed_time = round(diff) * 1000
-        time_to_completion = round((total - current) / speed) * 1000
-        estimated_total_time = elapsed_time + time_to_completion
-
-        elapsed_time = TimeFormatter(milliseconds=elapsed_time)
-        estimated_total_time = TimeFormatter(milliseconds=estimated_total_time)
-
-        progress = "{0}{1}".format(
-            ''.join(["■" for i in range(math.floor(percentage / 5))]),
-            ''.join(["□" for i in range(20 - math.floor(percentage / 5))])
-        )            
-        tmp = progress + Txt.PROGRESS_BAR.format( 
-            round(percentage, 2),
-            humanbytes(current),
-            humanbytes(total),
-            humanbytes(speed),            
-            estimated_total_time if estimated_total_time != '' else "0 s"
+        await edit_progress(current, total, ud_type, message, start)
+
+def throttled_progress(interval=1.0):
+    """Progress callback that edits at most once per interval, always showing completion"""
+    last_edit = 0.0
+
+    async def progress(current, total, ud_type, message, start):
+        nonlocal last_edit
+        now = time.monotonic()
+        if current != total and now - last_edit < interval:
+            return
+        last_edit = now
+        await edit_progress(current, total, ud_type, message, start)
+
+    return progress
+
+async def edit_progress(current, total, ud_type, message, start):
+    diff = max(time.monotonic() - start, 0.001)
+    percentage = current * 100 / total
+    speed = current / diff
+    elapsed_time = round(diff) * 1000
+    time_to_completion = round((total - current) / speed) * 1000 if speed else 0
+    estimated_total_time = elapsed_time + time_to_completion
+
+    elapsed_time = TimeFormatter(milliseconds=elapsed_time)
+    estimated_total_time = TimeFormatter(milliseconds=estimated_total_time)
+
+    progress = "{0}{1}".format(
+        ''.join(["■" for i in range(math.floor(percentage / 5))]),
+        ''.join(["□" for i in range(20 - math.floor(percentage / 5))])
+    )            
+    tmp = progress + Txt.PROGRESS_BAR.format( 
+        round(percentage, 2),
+        humanbytes(current),
+        humanbytes(total),
+        humanbytes(speed),            
+        estimated_total_time if estimated_total_time != '' else "0 s"
+    )
+    try:
+        await message.edit(
+            text=f"{ud_type}\n\n{tmp}",               
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("• ᴄᴀɴᴄᴇʟ •", callback_data="close")]])                                               
         )
-        try:
-            await message.edit(
-                text=f"{ud_type}\n\n{tmp}",               
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("• ᴄᴀɴᴄᴇʟ •", callback_data="close")]])                                               
-            )
-        except:
-            pass
+    except:
+        pass
 
 def humanbytes(size):    
     if not size:
@@ -80,9 +98,10 @@ async def send_log(b, u):
             f"**--Nᴇᴡ Uꜱᴇʀ Sᴛᴀʀᴛᴇᴅ Tʜᴇ Bᴏᴛ--**\n\nUꜱᴇʀ: {u.mention}\nIᴅ: `{u.id}`\nUɴ: @{u.username}\n\nDᴀᴛᴇ: {date}\nTɪᴍᴇ: {time}\n\nBy: {b.mention}"
         )
 
+FILENAME_EXT_PATTERN = re.compile(r'(?P<filename>.*?)(\.\w+)?$')
+
 def add_prefix_suffix(input_string, prefix='', suffix=''):
-    pattern = r'(?P<filename>.*?)(\.\w+)?$'
-    match = re.search(pattern, input_string)
+    match = FILENAME_EXT_PATTERN.search(input_string)
     if match:
         filename = match.group('filename')
         extension = match.group(2) or ''
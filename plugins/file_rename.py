@@ -1,21 +1,30 @@
 import os
 import re
+import json
 import time
 import shutil
 import asyncio
 import logging
-from datetime import datetime
+import tempfile
+import hashlib
+import weakref
+from functools import lru_cache
+from datetime import timedelta
+from xml.sax.saxutils import escape
 from PIL import Image
 from pyrogram import Client, filters
 from pyrogram.errors import FloodWait
 from pyrogram.types import InputMediaDocument, Message
 from hachoir.metadata import extractMetadata
 from hachoir.parser import createParser
+from mutagen.id3 import ID3, ID3NoHeaderError, TIT2, TPE1, TXXX
+from mutagen.mp4 import MP4, MP4FreeForm
 from plugins.antinsfw import check_anti_nsfw
-from helper.utils import progress_for_pyrogram, humanbytes, convert
+from plugins.sequence import is_in_sequence_mode
+from helper.utils import throttled_progress, humanbytes, convert
 from helper.database import codeflixbots
 from config import Config
-from pymongo import MongoClient
+from cachetools import LRUCache, TTLCache
 
 # Configure logging
 logging.basicConfig(
@@ -24,13 +33,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Global dictionary to track ongoing operations
-renaming_operations = {}
+# Locks of ongoing operations per file_id, dropped once no handler holds them
+renaming_operations = weakref.WeakValueDictionary()
+# Files finished in the last few seconds, to drop Telegram redeliveries
+recent_renames = TTLCache(maxsize=100000, ttl=10)
 
-# Database connection for checking sequence mode
-db_client = MongoClient(Config.DB_URL)
-db = db_client[Config.DB_NAME]
-sequence_collection = db["active_sequences"]
+# External tools, resolved once instead of walking PATH for every file
+FFMPEG = shutil.which('ffmpeg')
+FFPROBE = shutil.which('ffprobe')
+MKVPROPEDIT = shutil.which('mkvpropedit')
+# Caps concurrent ffmpeg remuxes so heavy load doesn't thrash the disk
+FFMPEG_SEM = asyncio.Semaphore(max(1, Config.FFMPEG_PARALLELISM))
+
+# Working directories, created once at import
+DOWNLOADS_DIR = "downloads"
+METADATA_DIR = "metadata"
+os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+os.makedirs(METADATA_DIR, exist_ok=True)
+
+# Processed thumbnails, keyed by the source thumbnail and pruned by last use
+THUMB_CACHE_DIR = os.path.join("cache", "thumbs")
+THUMB_CACHE_SIZE = 500
+os.makedirs(THUMB_CACHE_DIR, exist_ok=True)
+
+# Telegram serves files in 1 MiB chunks; smaller files aren't worth splitting
+CHUNK_SIZE = 1024 * 1024
+PARALLEL_DOWNLOAD_MIN_SIZE = 16 * CHUNK_SIZE
+
+# Durations of already parsed files, keyed by (file_id, file_size)
+_duration_cache = LRUCache(maxsize=4096)
+
+STANDALONE_NUMBER_PATTERN = re.compile(r'\b(?!(?:19|20)\d{2}\b)(\d{1,4})\b')
 
 # Enhanced regex patterns for season and episode extraction
 SEASON_EPISODE_PATTERNS = [
@@ -45,104 +78,342 @@ SEASON_EPISODE_PATTERNS = [
     # Fallback patterns (S01 13, Episode 13)
     (re.compile(r'S(\d+)[^\d]*(\d+)'), ('season', 'episode')),
     (re.compile(r'(?:E|EP|Episode)\s*(\d+)', re.IGNORECASE), (None, 'episode')),
-    # Final fallback (standalone number)
-    (re.compile(r'\b(\d+)\b'), (None, 'episode'))
+    # Final fallback (standalone number up to 4 digits, not a 19xx/20xx year)
+    (STANDALONE_NUMBER_PATTERN, (None, 'episode'))
 ]
 
+# Every season/episode pattern needs a digit, so digit-free names can skip them
+DIGIT_PATTERN = re.compile(r'\d')
+
 # Quality detection patterns
 QUALITY_PATTERNS = [
     (re.compile(r'\b(\d{3,4}[pi])\b', re.IGNORECASE), lambda m: m.groups()[0] if m.groups() else "Unknown"),
     (re.compile(r'\b(4k|2160p)\b', re.IGNORECASE), lambda m: "4k"),
     (re.compile(r'\b(2k|1440p)\b', re.IGNORECASE), lambda m: "2k"),
     (re.compile(r'\b(HDRip|HDTV)\b', re.IGNORECASE), lambda m: m.groups()[0] if m.groups() else "Unknown"),
-    (re.compile(r'\b(4kX264|4kx265)\b', re.IGNORECASE), lambda m: m.groups()[0] if m.groups() else "Unknown"),
-    (re.compile(r'\[(\d{3,4}[pi])\]', re.IGNORECASE), lambda m: m.groups()[0] if m.groups() else "Unknown")
+    (re.compile(r'\b(4kX264|4kx265)\b', re.IGNORECASE), lambda m: m.groups()[0] if m.groups() else "Unknown")
+    # Bracketed resolutions ([1080p]) are already matched by the first pattern
 ]
 
-def is_in_sequence_mode(user_id):
-    """Check if user is in sequence mode"""
-    try:
-        return sequence_collection.find_one({"user_id": user_id}) is not None
-    except Exception as e:
-        logger.error(f"Error checking sequence mode: {e}")
-        return False
+# Placeholders accepted in format templates
+PLACEHOLDER_PATTERN = re.compile(r'\{season\}|\{episode\}|\{quality\}|Season|Episode|QUALITY')
 
-def extract_season_episode(filename):
-    """Extract season and episode numbers from filename"""
-    for pattern, (season_group, episode_group) in SEASON_EPISODE_PATTERNS:
+@lru_cache(maxsize=4096)
+def render_filename(format_template, season, episode, quality, ext):
+    """Replace placeholders in the format template and append the extension"""
+    replacements = {
+        '{season}': season or 'XX',
+        '{episode}': episode or 'XX',
+        '{quality}': quality,
+        'Season': season or 'XX',
+        'Episode': episode or 'XX',
+        'QUALITY': quality
+    }
+    name = PLACEHOLDER_PATTERN.sub(lambda m: replacements[m.group(0)], format_template)
+    return f"{name}{ext}"
+
+@lru_cache(maxsize=4096)
+def _match_season_episode(filename, quality):
+    """Run the season/episode patterns against filename (memoized)"""
+    patterns = SEASON_EPISODE_PATTERNS if DIGIT_PATTERN.search(filename) else ()
+    for pattern, (season_group, episode_group) in patterns:
         match = pattern.search(filename)
         if match:
             groups = match.groups()
             season = groups[0] if season_group and len(groups) > 0 else None
             episode = groups[1] if episode_group and len(groups) > 1 else (groups[0] if len(groups) > 0 else None)
-            logger.info(f"Extracted season: {season}, episode: {episode} from {filename}")
+            # A bare number equal to the resolution (1080 from 1080p) is not an episode
+            if pattern is STANDALONE_NUMBER_PATTERN and quality and quality.lower().rstrip('pi') == episode:
+                break
             return season, episode
-    logger.warning(f"No season/episode pattern matched for {filename}")
     return None, None
 
-def extract_quality(filename):
-    """Extract quality information from filename"""
+def extract_season_episode(filename, quality=None):
+    """Extract season and episode numbers from filename"""
+    season, episode = _match_season_episode(filename, quality)
+    if season is None and episode is None:
+        logger.warning(f"No season/episode pattern matched for {filename}")
+    else:
+        logger.info(f"Extracted season: {season}, episode: {episode} from {filename}")
+    return season, episode
+
+@lru_cache(maxsize=4096)
+def _match_quality(filename):
+    """Run the quality patterns against filename (memoized)"""
     for pattern, extractor in QUALITY_PATTERNS:
         match = pattern.search(filename)
         if match:
-            quality = extractor(match)
-            logger.info(f"Extracted quality: {quality} from {filename}")
-            return quality
-    logger.warning(f"No quality pattern matched for {filename}")
-    return "Unknown"
+            return extractor(match)
+    return None
 
-async def cleanup_files(*paths):
-    """Safely remove files if they exist"""
+def extract_quality(filename):
+    """Extract quality information from filename"""
+    quality = _match_quality(filename)
+    if quality is None:
+        logger.warning(f"No quality pattern matched for {filename}")
+        return "Unknown"
+    logger.info(f"Extracted quality: {quality} from {filename}")
+    return quality
+
+def remove_files(paths):
+    """Remove files if they exist (blocking)"""
     for path in paths:
+        if not path:
+            continue
         try:
-            if path and os.path.exists(path):
-                os.remove(path)
-                logger.info(f"Cleaned up file: {path}")
+            os.unlink(path)
+            logger.info(f"Cleaned up file: {path}")
+        except FileNotFoundError:
+            pass
         except Exception as e:
             logger.error(f"Error removing {path}: {e}")
 
-async def process_thumbnail(thumb_path):
-    """Process and resize thumbnail image"""
-    if not thumb_path or not os.path.exists(thumb_path):
+def link_or_copy(src, dst):
+    """Expose src under dst with a hard link, copying across filesystems (blocking)"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+async def cleanup_files(*paths):
+    """Safely remove files if they exist"""
+    await asyncio.to_thread(remove_files, paths)
+
+async def fast_download(client, message, file_path, file_size, progress=None, progress_args=()):
+    """Download media over several connections, each fetching its own range of chunks"""
+    workers = max(1, Config.DOWNLOAD_WORKERS)
+    if workers == 1 or file_size < PARALLEL_DOWNLOAD_MIN_SIZE:
+        return await client.download_media(
+            message, file_name=file_path, progress=progress, progress_args=progress_args
+        )
+
+    total_chunks = -(-file_size // CHUNK_SIZE)
+    per_worker = -(-total_chunks // workers)
+    temp_path = f"{file_path}.temp"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    received = 0
+
+    async def fetch_range(first_chunk, count):
+        nonlocal received
+        position = first_chunk * CHUNK_SIZE
+        async for chunk in client.stream_media(message, limit=count, offset=first_chunk):
+            os.pwrite(fd, chunk, position)
+            position += len(chunk)
+            received += len(chunk)
+            if progress:
+                await progress(received, file_size, *progress_args)
+
+    tasks = []
+    try:
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(fd, 0, file_size)
+        tasks = [
+            asyncio.create_task(fetch_range(first, min(per_worker, total_chunks - first)))
+            for first in range(0, total_chunks, per_worker)
+        ]
+        await asyncio.gather(*tasks)
+        if received != file_size:
+            raise IOError(f"Incomplete download: got {received} of {file_size} bytes")
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        os.close(fd)
+        await cleanup_files(temp_path)
+        raise
+    os.close(fd)
+    os.replace(temp_path, file_path)
+    return file_path
+
+def resize_thumbnail(source, cache_path):
+    """Resize a thumbnail file or buffer into the cache, replacing cache_path atomically (blocking)"""
+    fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=THUMB_CACHE_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as out, Image.open(source) as img:
+            # Let libjpeg decode close to the target size instead of full resolution
+            img.draft("RGB", (320, 320))
+            img = img.convert("RGB")
+            img.thumbnail((320, 320), Image.Resampling.LANCZOS)
+            img.save(out, "JPEG", quality=85)
+        os.replace(temp_path, cache_path)
+    except BaseException:
+        remove_files([temp_path])
+        raise
+
+def prune_thumb_cache():
+    """Drop the least recently used cached thumbnails beyond THUMB_CACHE_SIZE (blocking)"""
+    entries = [entry for entry in os.scandir(THUMB_CACHE_DIR) if entry.name.endswith('.jpg')]
+    if len(entries) > THUMB_CACHE_SIZE:
+        entries.sort(key=lambda entry: entry.stat().st_atime)
+        remove_files([entry.path for entry in entries[:-THUMB_CACHE_SIZE]])
+
+async def process_thumbnail(source, cache_path):
+    """Process and resize thumbnail image into the cache"""
+    await asyncio.to_thread(resize_thumbnail, source, cache_path)
+    logger.info(f"Processed thumbnail: {cache_path}")
+    await asyncio.to_thread(prune_thumb_cache)
+    return cache_path
+
+async def probe_media(file_path):
+    """Read container and stream information of a media file using ffprobe"""
+    if not FFPROBE:
         return None
-    
     try:
-        with Image.open(thumb_path) as img:
-            img = img.convert("RGB").resize((320, 320))
-            img.save(thumb_path, "JPEG")
-        logger.info(f"Processed thumbnail: {thumb_path}")
-        return thumb_path
+        process = await asyncio.create_subprocess_exec(
+            FFPROBE, '-v', 'error', '-print_format', 'json',
+            '-show_format', '-show_streams', file_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            logger.warning(f"ffprobe failed for {file_path}: {stderr.decode()}")
+            return None
+        return json.loads(stdout)
     except Exception as e:
-        logger.error(f"Thumbnail processing failed: {e}")
-        await cleanup_files(thumb_path)
+        logger.error(f"Error probing {file_path}: {e}")
         return None
 
+def has_metadata(probe, metadata):
+    """Check if a probed file already carries the given metadata"""
+    def tags(entry):
+        return {key.lower(): value for key, value in entry.get('tags', {}).items()}
+
+    container_tags = tags(probe.get('format', {}))
+    if any(container_tags.get(key) != metadata[key] for key in ('title', 'artist', 'author')):
+        return False
+    stream_keys = {'video': 'video_title', 'audio': 'audio_title', 'subtitle': 'subtitle'}
+    for stream in probe.get('streams', []):
+        key = stream_keys.get(stream.get('codec_type'))
+        if key and tags(stream).get('title') != metadata[key]:
+            return False
+    return True
+
+async def edit_matroska_metadata(file_path, probe, metadata):
+    """Rewrite MKV/WebM tags in place with mkvpropedit, returning success"""
+    if not MKVPROPEDIT:
+        return False
+
+    # Global tags are replaced as a whole, so carry over the existing ones
+    global_tags = {
+        key.upper(): value
+        for key, value in probe.get('format', {}).get('tags', {}).items()
+        if key.lower() not in ('title', 'encoder', 'creation_time')
+    }
+    global_tags.update(ARTIST=metadata['artist'], AUTHOR=metadata['author'])
+    simple_tags = "".join(
+        f"<Simple><Name>{escape(name)}</Name><String>{escape(value)}</String></Simple>"
+        for name, value in global_tags.items()
+    )
+
+    cmd = [MKVPROPEDIT, file_path, '--edit', 'info', '--set', f'title={metadata["title"]}']
+    stream_keys = {'video': 'video_title', 'audio': 'audio_title', 'subtitle': 'subtitle'}
+    for stream in probe.get('streams', []):
+        key = stream_keys.get(stream.get('codec_type'))
+        # Cover art is exposed as a video stream but is an attachment, not a track
+        if key and not stream.get('disposition', {}).get('attached_pic'):
+            cmd += ['--edit', f'track:{stream["index"] + 1}', '--set', f'name={metadata[key]}']
+
+    tags_file = tempfile.NamedTemporaryFile('w', suffix='.xml', delete=False, encoding='utf-8')
+    try:
+        with tags_file:
+            tags_file.write(
+                '<?xml version="1.0" encoding="UTF-8"?>'
+                f'<Tags><Tag><Targets/>{simple_tags}</Tag></Tags>'
+            )
+        cmd += ['--tags', f'global:{tags_file.name}']
+
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, _ = await process.communicate()
+        # mkvpropedit exits with 1 for warnings and 2 for errors
+        if process.returncode > 1:
+            logger.warning(f"mkvpropedit failed for {file_path}: {stdout.decode()}")
+            return False
+        logger.info(f"Edited metadata in place for {file_path}")
+        return True
+    except Exception as e:
+        logger.error(f"mkvpropedit error for {file_path}: {e}")
+        return False
+    finally:
+        os.remove(tags_file.name)
+
+def write_audio_tags(file_path, metadata):
+    """Write title/artist/author tags into an MP3 or M4A file in place (blocking)"""
+    if file_path.lower().endswith('.mp3'):
+        try:
+            tags = ID3(file_path)
+        except ID3NoHeaderError:
+            tags = ID3()
+        tags.setall('TIT2', [TIT2(encoding=3, text=metadata['title'])])
+        tags.setall('TPE1', [TPE1(encoding=3, text=metadata['artist'])])
+        tags.setall('TXXX:author', [TXXX(encoding=3, desc='author', text=metadata['author'])])
+        tags.save(file_path)
+    else:
+        audio = MP4(file_path)
+        if audio.tags is None:
+            audio.add_tags()
+        audio.tags['\xa9nam'] = metadata['title']
+        audio.tags['\xa9ART'] = metadata['artist']
+        audio.tags['----:com.apple.iTunes:author'] = MP4FreeForm(metadata['author'].encode('utf-8'))
+        audio.save()
+
+async def edit_audio_metadata(file_path, metadata):
+    """Rewrite MP3/M4A tags in place with mutagen, returning success"""
+    try:
+        await asyncio.to_thread(write_audio_tags, file_path, metadata)
+        logger.info(f"Edited metadata in place for {file_path}")
+        return True
+    except Exception as e:
+        logger.error(f"mutagen error for {file_path}: {e}")
+        return False
+
 async def add_metadata(input_path, output_path, user_id):
-    """Add metadata to media file using ffmpeg"""
-    ffmpeg = shutil.which('ffmpeg')
-    if not ffmpeg:
+    """Add metadata to media file using ffmpeg, returning the path to upload"""
+    bundle = await codeflixbots.get_metadata_bundle(user_id)
+    if bundle['metadata'] == "Off":
+        logger.info(f"Metadata is off for user {user_id}, keeping original file")
+        return input_path
+
+    if not FFMPEG:
         logger.warning("FFmpeg not found in PATH, skipping metadata addition")
-        # Just copy the file instead of adding metadata
+        # Just link or copy the file instead of adding metadata
         try:
-            shutil.copy2(input_path, output_path)
+            await asyncio.to_thread(link_or_copy, input_path, output_path)
             logger.info(f"Copied file from {input_path} to {output_path}")
-            return
+            return output_path
         except Exception as e:
             logger.error(f"Error copying file: {e}")
             raise RuntimeError(f"Failed to process file: {e}")
     
     try:
         metadata = {
-            'title': await codeflixbots.get_title(user_id) or "Unknown",
-            'artist': await codeflixbots.get_artist(user_id) or "Unknown",
-            'author': await codeflixbots.get_author(user_id) or "Unknown",
-            'video_title': await codeflixbots.get_video(user_id) or "Video",
-            'audio_title': await codeflixbots.get_audio(user_id) or "Audio",
-            'subtitle': await codeflixbots.get_subtitle(user_id) or "Subtitle"
+            'title': bundle['title'] or "Unknown",
+            'artist': bundle['artist'] or "Unknown",
+            'author': bundle['author'] or "Unknown",
+            'video_title': bundle['video'] or "Video",
+            'audio_title': bundle['audio'] or "Audio",
+            'subtitle': bundle['subtitle'] or "Subtitle"
         }
+
+        probe = await probe_media(input_path)
+        if probe and has_metadata(probe, metadata):
+            logger.info(f"Metadata already present in {input_path}, skipping ffmpeg")
+            return input_path
+
+        # Audio and Matroska tags can be patched in place instead of remuxing the file
+        ext = os.path.splitext(input_path)[1].lower()
+        if ext in ('.mp3', '.m4a'):
+            if await edit_audio_metadata(input_path, metadata):
+                return input_path
+        elif probe and ext in ('.mkv', '.webm'):
+            if await edit_matroska_metadata(input_path, probe, metadata):
+                return input_path
         
         cmd = [
-            ffmpeg,
+            FFMPEG,
             '-i', input_path,
             '-metadata', f'title={metadata["title"]}',
             '-metadata', f'artist={metadata["artist"]}',
@@ -152,33 +423,51 @@ async def add_metadata(input_path, output_path, user_id):
             '-metadata:s:s', f'title={metadata["subtitle"]}',
             '-map', '0',
             '-c', 'copy',
-            '-loglevel', 'error',
-            output_path
+            '-loglevel', 'error'
         ]
+        # Put the moov atom first so Telegram can stream the upload
+        if output_path.lower().endswith(('.mp4', '.m4a', '.mov')):
+            cmd += ['-movflags', '+faststart']
+        cmd.append(output_path)
         
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        _, stderr = await process.communicate()
+        async with FFMPEG_SEM:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await process.communicate()
         
         if process.returncode != 0:
             raise RuntimeError(f"FFmpeg error: {stderr.decode()}")
         
         logger.info(f"Added metadata to {output_path}")
+        return output_path
     except Exception as e:
         logger.error(f"Metadata addition failed: {e}")
         raise
 
-def get_file_duration(file_path):
-    """Get duration of media file"""
+def read_duration(file_path):
+    """Read duration of media file in seconds using hachoir (blocking)"""
+    metadata = extractMetadata(createParser(file_path))
+    if metadata is not None and metadata.has("duration"):
+        return metadata.get("duration").total_seconds()
+    return 0
+
+async def get_file_duration(file_path, cache_key=None):
+    """Get duration of media file, memoized per cache_key"""
+    if cache_key is not None and cache_key in _duration_cache:
+        return _duration_cache[cache_key]
     try:
-        metadata = extractMetadata(createParser(file_path))
-        if metadata is not None and metadata.has("duration"):
-            duration_seconds = int(metadata.get("duration").seconds)
-            return str(datetime.timedelta(seconds=duration_seconds))
-        return "00:00:00"
+        probe = await probe_media(file_path)
+        if probe and 'duration' in probe.get('format', {}):
+            duration_seconds = float(probe['format']['duration'])
+        else:
+            duration_seconds = await asyncio.to_thread(read_duration, file_path)
+        duration = str(timedelta(seconds=int(duration_seconds)))
+        if cache_key is not None:
+            _duration_cache[cache_key] = duration
+        return duration
     except Exception as e:
         logger.error(f"Error getting duration: {e}")
         return "00:00:00"
@@ -203,6 +492,53 @@ def format_caption(caption_template, filename, filesize, duration):
         logger.error(f"Error formatting caption: {e}")
         return f"**{filename}**"
 
+async def fetch_thumbnail(client, message, media_type, thumb):
+    """Return the processed custom or original thumbnail, reusing the cache"""
+    if thumb:
+        source, key = thumb, hashlib.sha1(thumb.encode()).hexdigest()[:16]
+    elif media_type == "video" and message.video.thumbs:
+        source, key = message.video.thumbs[0].file_id, message.video.thumbs[0].file_unique_id
+    else:
+        return None
+
+    cache_path = os.path.join(THUMB_CACHE_DIR, f"{key}.jpg")
+    try:
+        # Touch on hit so pruning by access time keeps it (noatime mounts)
+        os.utime(cache_path)
+        return cache_path
+    except FileNotFoundError:
+        pass
+
+    try:
+        # Thumbnails are small, so decode straight from memory without a temp file
+        buffer = await client.download_media(source, in_memory=True)
+        buffer.seek(0)
+        return await process_thumbnail(buffer, cache_path)
+    except Exception as e:
+        logger.error(f"Thumbnail processing failed: {e}")
+        return None
+
+def build_caption(caption_template, filename, filesize, duration):
+    """Build the upload caption from the chat's caption template"""
+    try:
+        if caption_template:
+            return format_caption(caption_template, filename, filesize, duration)
+        return f"**{filename}**"
+    except Exception as e:
+        logger.error(f"Caption processing failed: {e}")
+        return f"**{filename}**"
+
+def needs_reupload(settings, media_type, file_name, new_filename):
+    """Check if renaming changes anything that requires downloading the file"""
+    if new_filename != file_name:
+        return True
+    if settings['metadata'] != "Off":
+        return True
+    if settings['thumbnail']:
+        return True
+    media_preference = settings['media_type']
+    return bool(media_preference) and media_preference.lower() != media_type
+
 @Client.on_message(filters.private & (filters.document | filters.video | filters.audio))
 async def auto_rename_files(client, message):
     """Main handler for auto-renaming files"""
@@ -220,7 +556,7 @@ async def auto_rename_files(client, message):
             )
         
         # Skip if user is in sequence mode
-        if is_in_sequence_mode(user_id):
+        if await is_in_sequence_mode(user_id):
             logger.info(f"User {user_id} is in sequence mode, skipping rename")
             return
         
@@ -258,71 +594,71 @@ async def auto_rename_files(client, message):
             logger.error(f"NSFW check failed: {e}")
 
         # Prevent duplicate processing
-        if file_id in renaming_operations:
-            if (datetime.now() - renaming_operations[file_id]).seconds < 10:
-                logger.info(f"Duplicate processing prevented for {file_id}")
-                return
-        renaming_operations[file_id] = datetime.now()
+        lock = renaming_operations.get(file_id)
+        if lock is None:
+            lock = renaming_operations[file_id] = asyncio.Lock()
+        if lock.locked() or file_id in recent_renames:
+            logger.info(f"Duplicate processing prevented for {file_id}")
+            return
+        # The lock is free, so this completes without yielding to other handlers
+        await lock.acquire()
 
         # Initialize paths to None for proper cleanup handling
         download_path = None
         metadata_path = None
-        thumb_path = None
+        thumb_task = None
 
         try:
             # Extract metadata from filename
-            season, episode = extract_season_episode(file_name)
+            quality = extract_quality(file_name)
+            season, episode = extract_season_episode(file_name, quality)
             if season is None and episode is None:
                 await message.reply_text(f"No season/episode pattern matched for: `{file_name}`")
                 # Optionally, return here to stop further processing
                 # return
-            quality = extract_quality(file_name)
             
-            # Replace placeholders in template
-            replacements = {
-                '{season}': season or 'XX',
-                '{episode}': episode or 'XX',
-                '{quality}': quality,
-                'Season': season or 'XX',
-                'Episode': episode or 'XX',
-                'QUALITY': quality
-            }
-            
-            for placeholder, value in replacements.items():
-                format_template = format_template.replace(placeholder, value)
-
             # Prepare file paths
             ext = os.path.splitext(file_name)[1] or ('.mp4' if media_type == 'video' else '.mp3')
-            new_filename = f"{format_template}{ext}"
-            
-            # Create safe directory names
-            downloads_dir = "downloads"
-            metadata_dir = "metadata"
-            
-            # Ensure directories exist
-            os.makedirs(downloads_dir, exist_ok=True)
-            os.makedirs(metadata_dir, exist_ok=True)
+            new_filename = render_filename(format_template, season, episode, quality, ext)
+
+            # Caption, thumbnail, media preference and metadata toggle in one read
+            settings = await codeflixbots.get_upload_settings(user_id)
+
+            # Nothing changes, so let Telegram copy the file server-side
+            if not needs_reupload(settings, media_type, file_name, new_filename):
+                media = message.video or message.audio
+                duration = str(timedelta(seconds=media.duration or 0)) if media else "00:00:00"
+                caption = build_caption(settings['caption'], new_filename, file_size, duration)
+                await client.copy_message(
+                    chat_id=message.chat.id,
+                    from_chat_id=message.chat.id,
+                    message_id=message.id,
+                    caption=caption
+                )
+                logger.info(f"Copied unchanged file without re-upload: {new_filename}")
+                return
             
-            download_path = os.path.join(downloads_dir, new_filename)
-            metadata_path = os.path.join(metadata_dir, new_filename)
+            download_path = os.path.join(DOWNLOADS_DIR, new_filename)
+            metadata_path = os.path.join(METADATA_DIR, new_filename)
+
+            # The thumbnail does not depend on the file, fetch it alongside the download
+            thumb_task = asyncio.create_task(fetch_thumbnail(client, message, media_type, settings['thumbnail']))
 
             # Download file
             msg = await message.reply_text("**Downloading...**")
             try:
-                file_path = await client.download_media(
-                    message,
-                    file_name=download_path,
-                    progress=progress_for_pyrogram,
-                    progress_args=("Downloading...", msg, time.time())
+                file_path = await fast_download(
+                    client, message, download_path, file_size,
+                    progress=throttled_progress(),
+                    progress_args=("Downloading...", msg, time.monotonic())
                 )
                 logger.info(f"Downloaded file to: {file_path}")
             except FloodWait as e:
                 await asyncio.sleep(e.value)
-                file_path = await client.download_media(
-                    message,
-                    file_name=download_path,
-                    progress=progress_for_pyrogram,
-                    progress_args=("Downloading...", msg, time.time())
+                file_path = await fast_download(
+                    client, message, download_path, file_size,
+                    progress=throttled_progress(),
+                    progress_args=("Downloading...", msg, time.monotonic())
                 )
             except Exception as e:
                 await msg.edit(f"Download failed: {str(e)}")
@@ -332,8 +668,7 @@ async def auto_rename_files(client, message):
             # Process metadata
             await msg.edit("**Processing metadata...**")
             try:
-                await add_metadata(file_path, metadata_path, user_id)
-                file_path = metadata_path
+                file_path = await add_metadata(file_path, metadata_path, user_id)
             except Exception as e:
                 await msg.edit(f"Metadata processing failed: {str(e)}")
                 logger.error(f"Metadata processing failed: {e}")
@@ -343,41 +678,20 @@ async def auto_rename_files(client, message):
             # Get duration for video/audio files
             duration = "00:00:00"
             if media_type in ["video", "audio"]:
-                duration = get_file_duration(file_path)
+                duration = await get_file_duration(file_path, (file_id, file_size))
 
             # Prepare for upload
             await msg.edit("**Preparing upload...**")
             
             # Get caption template and replace variables
-            try:
-                caption_template = await codeflixbots.get_caption(message.chat.id)
-                if caption_template:
-                    caption = format_caption(caption_template, new_filename, file_size, duration)
-                else:
-                    caption = f"**{new_filename}**"
-            except Exception as e:
-                logger.error(f"Caption processing failed: {e}")
-                caption = f"**{new_filename}**"
+            caption = build_caption(settings['caption'], new_filename, file_size, duration)
                 
             # Handle thumbnail
-            try:
-                thumb = await codeflixbots.get_thumbnail(message.chat.id)
-                
-                if thumb:
-                    thumb_path = await client.download_media(thumb)
-                elif media_type == "video" and message.video.thumbs:
-                    thumb_path = await client.download_media(message.video.thumbs[0].file_id)
-                
-                # Only process if thumb_path was set
-                if thumb_path:
-                    thumb_path = await process_thumbnail(thumb_path)
-            except Exception as e:
-                logger.error(f"Thumbnail processing failed: {e}")
-                thumb_path = None
+            thumb_path = await thumb_task
 
             # Get user's media preference
             try:
-                user_media_preference = await codeflixbots.get_media_preference(user_id)
+                user_media_preference = settings['media_type']
                 logger.info(f"User {user_id} media preference: {user_media_preference}")
                 
                 # If no preference set, use original media type
@@ -398,8 +712,8 @@ async def auto_rename_files(client, message):
                 upload_params = {
                     'chat_id': message.chat.id,
                     'caption': caption,
-                    'progress': progress_for_pyrogram,
-                    'progress_args': ("Uploading...", msg, time.time())
+                    'progress': throttled_progress(),
+                    'progress_args': ("Uploading...", msg, time.monotonic())
                 }
                 
                 # Only add thumb to parameters if it exists
@@ -448,9 +762,13 @@ async def auto_rename_files(client, message):
             except:
                 pass
         finally:
-            # Clean up files - safe to pass None values
-            await cleanup_files(download_path, metadata_path, thumb_path)
-            renaming_operations.pop(file_id, None)
+            # Stop the thumbnail fetch if the upload never used it
+            if thumb_task and not thumb_task.done():
+                thumb_task.cancel()
+            # Clean up files - safe to pass None values; thumbnails stay cached
+            await cleanup_files(download_path, metadata_path)
+            recent_renames[file_id] = True
+            lock.release()
             logger.info(f"Cleanup completed for file: {file_id}")
             
     except Exception as e:
@@ -1,68 +1,86 @@
 import os
+import asyncio
+from functools import lru_cache
 from pyrogram import Client, filters
+from pyrogram.enums import ChatMemberStatus
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 from pyrogram.errors import UserNotParticipant
 from config import Config
+from cachetools import TTLCache
 
 FORCE_SUB_CHANNELS = Config.FORCE_SUB_CHANNELS
 IMAGE_URL = "https://i.ibb.co/gFQFknCN/d8a33273f73c.jpg"
+# Telegram file_id of IMAGE_URL once sent, so later prompts don't refetch the URL
+_cached_photo_id = None
 
-async def not_subscribed(_, __, message):
-    for channel in FORCE_SUB_CHANNELS:
-        try:
-            user = await message._client.get_chat_member(channel, message.from_user.id)
-            if user.status in {"kicked", "left"}:
-                return True
-        except UserNotParticipant:
-            return True
-    return False
+# Statuses that mean the user isn't in the channel
+_BAD_STATUS = frozenset((ChatMemberStatus.BANNED, ChatMemberStatus.LEFT))
+_JOIN_BTN_FMT = "• ᴊᴏɪɴ {} •"
+_JOINED_FOOTER_BTN = InlineKeyboardButton(text="• ᴊᴏɪɴᴇᴅ •", callback_data="check_subscription")
 
-@Client.on_message(filters.private & filters.create(not_subscribed))
-async def forces_sub(client, message):
+# (user_id, channel) pairs recently seen as joined; misses are always rechecked
+_joined_cache = TTLCache(maxsize=50000, ttl=300)
+
+async def _get_missing(client, user_id):
+    """Return the force-sub channels the user hasn't joined, checking all of them concurrently"""
+    channels = [channel for channel in FORCE_SUB_CHANNELS if (user_id, channel) not in _joined_cache]
+    if not channels:
+        return []
+    results = await asyncio.gather(
+        *(client.get_chat_member(channel, user_id) for channel in channels),
+        return_exceptions=True
+    )
     not_joined_channels = []
-    for channel in FORCE_SUB_CHANNELS:
-        try:
-            user = await client.get_chat_member(channel, message.from_user.id)
-            if user.status in {"kicked", "left"}:
-                not_joined_channels.append(channel)
-        except UserNotParticipant:
+    for channel, result in zip(channels, results):
+        if isinstance(result, UserNotParticipant):
+            not_joined_channels.append(channel)
+        elif isinstance(result, BaseException):
+            raise result
+        elif result.status in _BAD_STATUS:
             not_joined_channels.append(channel)
+        else:
+            _joined_cache[(user_id, channel)] = True
+    return not_joined_channels
 
+@lru_cache(maxsize=64)
+def _join_markup(not_joined_channels):
+    """Build the join keyboard for a tuple of missing channels, reused across users"""
     buttons = [
         [
             InlineKeyboardButton(
-                text=f"• ᴊᴏɪɴ {channel.capitalize()} •", url=f"https://t.me/{channel}"
+                text=_JOIN_BTN_FMT.format(channel.capitalize()), url=f"https://t.me/{channel}"
             )
         ]
         for channel in not_joined_channels
     ]
-    buttons.append(
-        [
-            InlineKeyboardButton(
-                text="• ᴊᴏɪɴᴇᴅ •", callback_data="check_subscription"
-            )
-        ]
-    )
+    buttons.append([_JOINED_FOOTER_BTN])
+    return InlineKeyboardMarkup(buttons)
+
+async def not_subscribed(_, __, message):
+    # Kept on the message so forces_sub doesn't check the channels again
+    message._missing_channels = await _get_missing(message._client, message.from_user.id)
+    return bool(message._missing_channels)
+
+@Client.on_message(filters.private & filters.create(not_subscribed))
+async def forces_sub(client, message):
+    global _cached_photo_id
+    not_joined_channels = getattr(message, "_missing_channels", None)
+    if not_joined_channels is None:
+        not_joined_channels = await _get_missing(client, message.from_user.id)
 
     text = "**ʙᴀᴋᴋᴀ!!, ʏᴏᴜ'ʀᴇ ɴᴏᴛ ᴊᴏɪɴᴇᴅ ᴛᴏ ᴀʟʟ ʀᴇǫᴜɪʀᴇᴅ ᴄʜᴀɴɴᴇʟs, ᴊᴏɪɴ ᴛʜᴇ ᴜᴘᴅᴀᴛᴇ ᴄʜᴀɴɴᴇʟs ᴛᴏ ᴄᴏɴᴛɪɴᴜᴇ**"
-    await message.reply_photo(
-        photo=IMAGE_URL,
+    sent = await message.reply_photo(
+        photo=_cached_photo_id or IMAGE_URL,
         caption=text,
-        reply_markup=InlineKeyboardMarkup(buttons)
+        reply_markup=_join_markup(tuple(not_joined_channels))
     )
+    if _cached_photo_id is None and sent.photo:
+        _cached_photo_id = sent.photo.file_id
 
 @Client.on_callback_query(filters.regex("check_subscription"))
 async def check_subscription(client, callback_query: CallbackQuery):
     user_id = callback_query.from_user.id
-    not_joined_channels = []
-
-    for channel in FORCE_SUB_CHANNELS:
-        try:
-            user = await client.get_chat_member(channel, user_id)
-            if user.status in {"kicked", "left"}:
-                not_joined_channels.append(channel)
-        except UserNotParticipant:
-            not_joined_channels.append(channel)
+    not_joined_channels = await _get_missing(client, user_id)
 
     if not not_joined_channels:
         new_text = "**ʏᴏᴜ ʜᴀᴠᴇ ᴊᴏɪɴᴇᴅ ᴀʟʟ ᴛʜᴇ ʀᴇǫᴜɪʀᴇᴅ ᴄʜᴀɴɴᴇʟs. ɢᴏᴏᴅ ʙᴏʏ! 🔥 /start ɴᴏᴡ**"
@@ -74,26 +92,9 @@ async def check_subscription(client, callback_query: CallbackQuery):
                 ])
             )
     else:
-        buttons = [
-            [
-                InlineKeyboardButton(
-                    text=f"• ᴊᴏɪɴ {channel.capitalize()} •",
-                    url=f"https://t.me/{channel}",
-                )
-            ]
-            for channel in not_joined_channels
-        ]
-        buttons.append(
-            [
-                InlineKeyboardButton(
-                    text="• ᴊᴏɪɴᴇᴅ •", callback_data="check_subscription"
-                )
-            ]
-        )
-
         text = "**ʏᴏᴜ ʜᴀᴠᴇ ᴊᴏɪɴᴇᴅ ᴀʟʟ ᴛʜᴇ ʀᴇǫᴜɪʀᴇᴅ ᴄʜᴀɴɴᴇʟs. ᴘʟᴇᴀsᴇ ᴊᴏɪɴ ᴛʜᴇ ᴜᴘᴅᴀᴛᴇ ᴄʜᴀɴɴᴇʟs ᴛᴏ ᴄᴏɴᴛɪɴᴜᴇ**"
         if callback_query.message.caption != text:
             await callback_query.message.edit_caption(
                 caption=text,
-                reply_markup=InlineKeyboardMarkup(buttons)
+                reply_markup=_join_markup(tuple(not_joined_channels))
             )
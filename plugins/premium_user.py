@@ -1,9 +1,10 @@
 from pyrogram import Client, filters
+import re
 import datetime
-import pytz
 from helper.database import codeflixbots
 import logging
 from config import Config
+from cachetools import TTLCache
 
 # Configure logging
 logging.basicConfig(
@@ -12,39 +13,54 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# India has no DST, so a fixed offset matches Asia/Kolkata without pytz
+IST = datetime.timezone(datetime.timedelta(hours=5, minutes=30), "IST")
+_EXPIRY_FMT = "%d %b %Y, %H:%M:%S IST"
+
+# Resolved users by id and lowercased username, to skip repeat get_users calls
+_user_cache = TTLCache(maxsize=1000, ttl=600)
+
+async def get_user_cached(client, identifier):
+    """Resolve a user id or username to a User, caching the lookup"""
+    key = identifier.lower() if isinstance(identifier, str) else identifier
+    user = _user_cache.get(key)
+    if user is None:
+        user = await client.get_users(identifier)
+        _user_cache[key] = user
+        _user_cache[user.id] = user
+    return user
+
+# Premium durations: minutes, hours, days or months (Xm/Xh/Xd/Xmh)
+_DUR_RE = re.compile(r'^(\d+)(m|h|d|mh)$')
+
+async def _parse_target(client, identifier):
+    """Resolve a numeric id, @username or username to (user_id, User or None)"""
+    if identifier.isdigit():
+        return int(identifier), None
+    user = await get_user_cached(client, identifier.removeprefix("@"))
+    return user.id, user
+
 # Command to add premium user
 @Client.on_message(filters.command("addpremium") & filters.user(Config.BOT_OWNER))
 async def add_premium_command(client, message):
     """Add a user as premium for a given time period"""
     try:
         # Parse command format: /addpremium [reply/userid/username] [duration: Xm/Xh/Xd/Xmh]
-        command_parts = message.text.split()
+        command_parts = message.text.split(maxsplit=2)
+        user = None
         
         # Handle reply case with only duration provided
         if message.reply_to_message and len(command_parts) == 2:
-            user_id = message.reply_to_message.from_user.id
+            user = message.reply_to_message.from_user
+            user_id = user.id
             duration = command_parts[1]
         # Handle direct command with both user and duration
         elif len(command_parts) == 3:
-            user_identifier = command_parts[1]
             duration = command_parts[2]
-            
-            # Check if user_identifier is a numeric ID
-            if user_identifier.isdigit():
-                user_id = int(user_identifier)
-            else:
-                # Handle username
-                if user_identifier.startswith("@"):
-                    username = user_identifier[1:]  # Remove @ symbol
-                else:
-                    username = user_identifier
-                    
-                # Resolve username to user ID
-                try:
-                    user = await client.get_users(username)
-                    user_id = user.id
-                except Exception as e:
-                    return await message.reply_text(f"Failed to find user: {e}")
+            try:
+                user_id, user = await _parse_target(client, command_parts[1])
+            except Exception as e:
+                return await message.reply_text(f"Failed to find user: {e}")
         else:
             return await message.reply_text(
                 "**Usage:** `/addpremium [reply/userid/username] [duration: Xm/Xh/Xd/Xmh]`\n\n"
@@ -54,10 +70,11 @@ async def add_premium_command(client, message):
                 "- Reply to message: `/addpremium 6h` (reply to add 6 hours)"
             )
         
-        # Check if user exists in database, add if not
-        if not await codeflixbots.is_user_exist(user_id):
-            user = codeflixbots.new_user(user_id)
-            await codeflixbots.col.insert_one(user)
+        if not _DUR_RE.match(duration):
+            return await message.reply_text(f"❌ Invalid duration `{duration}`. Use Xm, Xh, Xd or Xmh.")
+        
+        # Create the user's document if it doesn't exist yet
+        await codeflixbots.ensure_user(user_id)
         
         # Add user as premium
         success, result = await codeflixbots.add_premium_user(user_id, duration)
@@ -65,7 +82,7 @@ async def add_premium_command(client, message):
         if success:
             # Try to get username for notification message
             try:
-                user_info = await client.get_users(user_id)
+                user_info = user or await get_user_cached(client, user_id)
                 username_text = f"@{user_info.username}" if user_info.username else f"[User](tg://user?id={user_id})"
             except:
                 username_text = f"User ID: `{user_id}`"
@@ -73,9 +90,7 @@ async def add_premium_command(client, message):
             # Format expiry date for display in IST
             try:
                 expiry_date = datetime.datetime.fromisoformat(result)
-                ist_timezone = pytz.timezone('Asia/Kolkata')
-                expiry_date_ist = expiry_date.astimezone(ist_timezone)
-                formatted_expiry = expiry_date_ist.strftime("%d %b %Y, %H:%M:%S IST")
+                formatted_expiry = expiry_date.astimezone(IST).strftime(_EXPIRY_FMT)
             except:
                 formatted_expiry = result
 
@@ -106,18 +121,10 @@ async def check_premium_command(client, message):
     user_id = message.from_user.id
     
     # Check if admin is checking another user's status
-    command_parts = message.text.split()
-    if len(command_parts) > 1 and message.from_user.id in Config.BOT_OWNER:
+    command_parts = message.text.split(maxsplit=1)
+    if len(command_parts) > 1 and message.from_user.id == Config.BOT_OWNER:
         try:
-            check_user = command_parts[1]
-            if check_user.isdigit():
-                user_id = int(check_user)
-            elif check_user.startswith("@"):
-                user = await client.get_users(check_user[1:])
-                user_id = user.id
-            else:
-                user = await client.get_users(check_user)
-                user_id = user.id
+            user_id, _ = await _parse_target(client, command_parts[1])
         except Exception as e:
             return await message.reply_text(f"Failed to find user: {e}")
     
@@ -128,9 +135,8 @@ async def check_premium_command(client, message):
     if is_premium and premium_details:
         try:
             expiry_date = datetime.datetime.fromisoformat(premium_details["expiry_date"])
-            ist_timezone = pytz.timezone('Asia/Kolkata')
-            expiry_date_ist = expiry_date.astimezone(ist_timezone)
-            remaining_time = expiry_date_ist - datetime.datetime.now(ist_timezone)
+            expiry_date_ist = expiry_date.astimezone(IST)
+            remaining_time = expiry_date_ist - datetime.datetime.now(IST)
     
             # Format remaining time nicely
             days = remaining_time.days
@@ -146,7 +152,7 @@ async def check_premium_command(client, message):
     
             await message.reply_text(
         f"✨ **Premium Status: Active** ✨\n\n"
-        f"**Expires on:** `{expiry_date_ist.strftime('%d %b %Y, %H:%M:%S IST')}`\n"
+        f"**Expires on:** `{expiry_date_ist.strftime(_EXPIRY_FMT)}`\n"
         f"**Time remaining:** `{time_str}`\n\n"
         f"You have access to all premium features including file renaming!"
     )
@@ -169,42 +175,31 @@ async def remove_premium_command(client, message):
     """Remove premium status from a user"""
     try:
         # Parse command
-        command_parts = message.text.split()
+        command_parts = message.text.split(maxsplit=2)
         
         if len(command_parts) != 2 and not message.reply_to_message:
             return await message.reply_text(
                 "**Usage:** `/rmpremium [userid/username]` or reply to a user's message"
             )
         
+        user = None
+        
         # Handle reply case
         if message.reply_to_message:
-            user_id = message.reply_to_message.from_user.id
+            user = message.reply_to_message.from_user
+            user_id = user.id
         else:
-            user_identifier = command_parts[1]
-            
-            # Check if user_identifier is a numeric ID
-            if user_identifier.isdigit():
-                user_id = int(user_identifier)
-            else:
-                # Handle username
-                if user_identifier.startswith("@"):
-                    username = user_identifier[1:]
-                else:
-                    username = user_identifier
-                    
-                # Resolve username to user ID
-                try:
-                    user = await client.get_users(username)
-                    user_id = user.id
-                except Exception as e:
-                    return await message.reply_text(f"Failed to find user: {e}")
+            try:
+                user_id, user = await _parse_target(client, command_parts[1])
+            except Exception as e:
+                return await message.reply_text(f"Failed to find user: {e}")
         
         # Remove premium
         success = await codeflixbots.remove_premium(user_id)
         
         if success:
             try:
-                user_info = await client.get_users(user_id)
+                user_info = user or await get_user_cached(client, user_id)
                 username_text = f"@{user_info.username}" if user_info.username else f"[User](tg://user?id={user_id})"
             except:
                 username_text = f"User ID: `{user_id}`"
@@ -255,7 +250,7 @@ async def list_premium_users(client, message):
             # Convert string to datetime
             try:
                 expiry_date = datetime.datetime.fromisoformat(expiry)
-                current_date = datetime.datetime.now(pytz.UTC)
+                current_date = datetime.datetime.now(datetime.timezone.utc)
                 
                 # Skip if premium has expired
                 if current_date > expiry_date:
@@ -265,13 +260,11 @@ async def list_premium_users(client, message):
                 premium_count += 1
                 
                 # Format expiry date
-                ist_timezone = pytz.timezone('Asia/Kolkata')
-                expiry_date_ist = expiry_date.astimezone(ist_timezone)
-                formatted_expiry = expiry_date_ist.strftime("%d %b %Y")
+                formatted_expiry = expiry_date.astimezone(IST).strftime("%d %b %Y")
                 
                 # Try to get user info
                 try:
-                    user_info = await client.get_users(user_id)
+                    user_info = await get_user_cached(client, user_id)
                     if user_info.username:
                         user_display = f"@{user_info.username}"
                     else:
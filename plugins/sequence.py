@@ -1,18 +1,28 @@
 import asyncio
 from pyrogram import Client, filters
+from pyrogram.errors import FloodWait
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message
 import re
 from collections import defaultdict
-from pymongo import MongoClient
 from datetime import datetime
-from config import Config
+from cachetools import TTLCache
+from helper.database import codeflixbots
 
-# Database setup
-db_client = MongoClient(Config.DB_URL)
-db = db_client[Config.DB_NAME]
+# Database setup, sharing the bot's Motor client and its connection pool
+db = codeflixbots.codeflixbots
 users_collection = db["users_sequence"]
 sequence_collection = db["active_sequences"]  # Simplified collection name
 
+# Users in sequence mode and their queued files. Mongo only records who is
+# active, so files queued since the last restart are lost if the bot restarts.
+_active = set()
+_buffers = {}
+_loaded = False
+_load_lock = asyncio.Lock()
+
+# Rendered /leaderboard text, cleared whenever the stats change
+_leaderboard_cache = TTLCache(maxsize=1, ttl=30)
+
 # Patterns for extracting episode numbers
 patterns = [
     re.compile(r'\b(?:EP|E)\s*-\s*(\d{1,3})\b', re.IGNORECASE),  # "Ep - 06" format fix
@@ -20,9 +30,8 @@ patterns = [
     re.compile(r'S(\d+)(?:E|EP)(\d+)', re.IGNORECASE),  # "S1E06" / "S01EP06"
     re.compile(r'S(\d+)\s*(?:E|EP|-\s*EP)\s*(\d+)', re.IGNORECASE),  # "S 1 Ep 06"
     re.compile(r'(?:[([<{]?\s*(?:E|EP)\s*(\d+)\s*[)\]>}]?)', re.IGNORECASE),  # "E(06)"
+    # Matches any digit run, so it is also the last resort; nothing after it can run
     re.compile(r'(?:EP|E)?\s*[-]?\s*(\d{1,3})', re.IGNORECASE),  # "E - 06" / "- 06"
-    re.compile(r'S(\d+)[^\d]*(\d+)', re.IGNORECASE),  # "S1 - 06"
-    re.compile(r'(\d+)')  # Simple fallback (last resort)
 ]
 
 def extract_episode_number(filename):
@@ -33,21 +42,59 @@ def extract_episode_number(filename):
             return int(match.groups()[-1])
     return float('inf')  
 
-def is_in_sequence_mode(user_id):
+async def _load_active():
+    """Ensure indexes and seed the in-memory sequence state from Mongo once after startup"""
+    global _loaded
+    if _loaded:
+        return
+    async with _load_lock:
+        if _loaded:
+            return
+        # Point lookups by user and the leaderboard sort; create_index is a no-op if present
+        try:
+            await sequence_collection.create_index("user_id")
+            await users_collection.create_index("user_id")
+            await users_collection.create_index([("files_sequenced", -1)])
+        except Exception as e:
+            print(f"Error creating sequence indexes: {e}")
+        async for doc in sequence_collection.find({}, {"user_id": 1, "files": 1}):
+            _active.add(doc["user_id"])
+            _buffers[doc["user_id"]] = doc.get("files", [])
+        _loaded = True
+
+async def is_in_sequence_mode(user_id):
     """Check if user is in sequence mode"""
-    return sequence_collection.find_one({"user_id": user_id}) is not None
+    await _load_active()
+    return user_id in _active
+
+async def copy_file(client, chat_id, file):
+    """Copy a queued file, waiting out a flood limit once if Telegram imposes one"""
+    try:
+        await client.copy_message(chat_id=chat_id, from_chat_id=file["chat_id"], message_id=file["msg_id"])
+    except FloodWait as e:
+        await asyncio.sleep(e.value)
+        await client.copy_message(chat_id=chat_id, from_chat_id=file["chat_id"], message_id=file["msg_id"])
+
+async def edit_progress(progress, text):
+    """Best-effort progress edit, run in the background so sends don't wait on it"""
+    try:
+        await progress.edit_text(text)
+    except Exception as e:
+        print(f"Error updating progress: {e}")
 
 @Client.on_message(filters.private & filters.command("startsequence"))
 async def start_sequence(client, message):
     user_id = message.from_user.id
     
     # Check if already in sequence mode
-    if is_in_sequence_mode(user_id):
+    if await is_in_sequence_mode(user_id):
         await message.reply_text("⚠️ Sequence mode is already active. Send your files or use /endsequence.")
         return
         
     # Create new sequence entry
-    sequence_collection.insert_one({
+    _active.add(user_id)
+    _buffers[user_id] = []
+    await sequence_collection.insert_one({
         "user_id": user_id,
         "files": [],
         "started_at": datetime.now()
@@ -59,53 +106,56 @@ async def start_sequence(client, message):
 async def end_sequence(client, message):
     user_id = message.from_user.id
     
-    # Get sequence data
-    sequence_data = sequence_collection.find_one({"user_id": user_id})
-    
-    if not sequence_data or not sequence_data.get("files"):
+    await _load_active()
+    if not _buffers.get(user_id):
         await message.reply_text("❌ No files in sequence!")
         return
     
-    # Get files and sort them
-    files = sequence_data.get("files", [])
+    # End the sequence before sending, so files sent meanwhile are renamed normally
+    files = _buffers.pop(user_id)
+    _active.discard(user_id)
+    
+    # Sort the queued files
     sorted_files = sorted(files, key=lambda x: extract_episode_number(x["filename"]))
     total = len(sorted_files)
     
-    # Send progress message
-    progress = await message.reply_text(f"⏳ Processing and sorting {total} files...")
+    # Drop the sequence record and send the progress message together
+    _, progress = await asyncio.gather(
+        sequence_collection.delete_one({"user_id": user_id}),
+        message.reply_text(f"⏳ Processing and sorting {total} files...")
+    )
     
     sent_count = 0
+    edit_task = None
     
-    # Send files in sequence
+    # Send files one at a time so they arrive in order; flood limits are
+    # handled by waiting when Telegram asks instead of a fixed delay
     for i, file in enumerate(sorted_files, 1):
         try:
-            await client.copy_message(
-                chat_id=message.chat.id, 
-                from_chat_id=file["chat_id"], 
-                message_id=file["msg_id"]
-            )
+            await copy_file(client, message.chat.id, file)
             sent_count += 1
             
-            # Update progress every 5 files
-            if i % 5 == 0:
-                await progress.edit_text(f"📤 Sent {i}/{total} files...")
-            
-            await asyncio.sleep(0.5)  # Add delay to prevent flooding
+            # Update progress every 5 files, skipping if the last edit is still in flight
+            if i % 5 == 0 and (edit_task is None or edit_task.done()):
+                edit_task = asyncio.create_task(edit_progress(progress, f"📤 Sent {i}/{total} files..."))
         except Exception as e:
             print(f"Error sending file: {e}")
     
-    # Update user stats
-    users_collection.update_one(
-        {"user_id": user_id},
-        {"$inc": {"files_sequenced": sent_count}, 
-         "$set": {"username": message.from_user.first_name}},
-        upsert=True
-    )
+    # Let a pending progress edit land first so it can't overwrite the summary
+    if edit_task:
+        await edit_task
     
-    # Remove sequence data
-    sequence_collection.delete_one({"user_id": user_id})
-    
-    await progress.edit_text(f"✅ Successfully sent {sent_count} files in sequence!")
+    # Update user stats alongside the final summary
+    await asyncio.gather(
+        users_collection.update_one(
+            {"user_id": user_id},
+            {"$inc": {"files_sequenced": sent_count}, 
+             "$set": {"username": message.from_user.first_name}},
+            upsert=True
+        ),
+        progress.edit_text(f"✅ Successfully sent {sent_count} files in sequence!")
+    )
+    _leaderboard_cache.clear()
 
 # File handler with higher group priority to ensure it runs before rename handler
 @Client.on_message(filters.private & (filters.document | filters.video | filters.audio), group=0)
@@ -113,7 +163,7 @@ async def sequence_file_handler(client, message):
     user_id = message.from_user.id
     
     # Check if user is in sequence mode
-    if is_in_sequence_mode(user_id):
+    if await is_in_sequence_mode(user_id):
         # Get file name based on media type
         if message.document:
             file_name = message.document.file_name
@@ -132,11 +182,8 @@ async def sequence_file_handler(client, message):
             "added_at": datetime.now()
         }
         
-        # Add to sequence collection
-        sequence_collection.update_one(
-            {"user_id": user_id},
-            {"$push": {"files": file_info}}
-        )
+        # Queue in memory; nothing is written to Mongo per file
+        _buffers.setdefault(user_id, []).append(file_info)
         
         # Set flag to indicate this is for sequence
         message.stop_propagation()
@@ -148,9 +195,13 @@ async def cancel_sequence(client, message):
     user_id = message.from_user.id
     
     # Remove sequence data
-    result = sequence_collection.delete_one({"user_id": user_id})
+    await _load_active()
+    was_active = user_id in _active
+    _active.discard(user_id)
+    _buffers.pop(user_id, None)
+    result = await sequence_collection.delete_one({"user_id": user_id})
     
-    if result.deleted_count > 0:
+    if was_active or result.deleted_count > 0:
         await message.reply_text("❌ Sequence mode cancelled. All queued files have been cleared.")
     else:
         await message.reply_text("❓ No active sequence found to cancel.")
@@ -159,14 +210,13 @@ async def cancel_sequence(client, message):
 async def show_sequence(client, message):
     user_id = message.from_user.id
     
-    # Get sequence data
-    sequence_data = sequence_collection.find_one({"user_id": user_id})
+    await _load_active()
+    files = _buffers.get(user_id)
     
-    if not sequence_data or not sequence_data.get("files"):
+    if not files:
         await message.reply_text("No files in current sequence.")
         return
     
-    files = sequence_data.get("files", [])
     sorted_files = sorted(files, key=lambda x: extract_episode_number(x["filename"]))
     
     file_list = "\n".join([
@@ -183,17 +233,20 @@ async def show_sequence(client, message):
 
 @Client.on_message(filters.command("leaderboard"))
 async def leaderboard(client, message):
-    top_users = list(users_collection.find().sort("files_sequenced", -1).limit(5))
-    
-    if not top_users:
-        await message.reply_text("No data available in the leaderboard yet!")
-        return
+    leaderboard_text = _leaderboard_cache.get("text")
+    if leaderboard_text is None:
+        top_users = await users_collection.find().sort("files_sequenced", -1).limit(5).to_list(length=5)
         
-    leaderboard_text = "**🏆 Top Users - File Sequencing 🏆**\n\n"
+        if not top_users:
+            await message.reply_text("No data available in the leaderboard yet!")
+            return
+            
+        leaderboard_text = "**🏆 Top Users - File Sequencing 🏆**\n\n"
 
-    for index, user in enumerate(top_users, start=1):
-        username = user.get('username', 'Unknown User')
-        files_count = user.get('files_sequenced', 0)
-        leaderboard_text += f"**{index}. {username}** - {files_count} files\n"
+        for index, user in enumerate(top_users, start=1):
+            username = user.get('username', 'Unknown User')
+            files_count = user.get('files_sequenced', 0)
+            leaderboard_text += f"**{index}. {username}** - {files_count} files\n"
+        _leaderboard_cache["text"] = leaderboard_text
 
     await message.reply_text(leaderboard_text)